@@ -5,11 +5,13 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from bson import ObjectId
 from datetime import datetime, timezone
 import os
+import orjson
 from dotenv import load_dotenv
-from typing import Union
+from typing import AsyncIterator, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -22,11 +24,24 @@ database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(database_url)
     db = _client[database_name]
 
+# Collection handles, resolved once at import (None when the database is not configured)
+projects = db.project if db is not None else None
+employees = db.employee if db is not None else None
+timesheets = db.timesheetentry if db is not None else None
+submissions = db.submission if db is not None else None
+signatures = db.signature if db is not None else None
+
+CollectionRef = Union[str, AsyncIOMotorCollection]
+
+def _collection(collection: CollectionRef) -> AsyncIOMotorCollection:
+    """Accept a collection handle or, for ad-hoc use, a collection name"""
+    return db[collection] if isinstance(collection, str) else collection
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection: CollectionRef, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +55,87 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await _collection(collection).insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def create_documents(collection: CollectionRef, items: list):
+    """Insert many documents with timestamps in a single round-trip"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    if not items:
+        return []
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    result = await _collection(collection).insert_many(docs, ordered=False)
+    return [str(x) for x in result.inserted_ids]
+
+async def get_documents(collection: CollectionRef, filter_dict: dict = None, limit: int = None, projection: dict = None):
+    """Get documents from collection, optionally restricted to the projected fields"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = _collection(collection).find(filter_dict or {}, projection)
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
+
+async def iter_documents(collection: CollectionRef, filter_dict: dict = None, projection: dict = None) -> AsyncIterator[bytes]:
+    """Stream documents from a collection as a JSON array, one chunk per document.
+
+    The first batch is fetched before returning, so query errors raise here
+    rather than after a streaming response has already sent its status.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    cursor = _collection(collection).find(filter_dict or {}, projection)
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        first = None
+
+    async def _chunks():
+        if first is None:
+            yield b"[]"
+            return
+        yield b"[" + orjson.dumps(first, default=str)
+        async for doc in cursor:
+            yield b"," + orjson.dumps(doc, default=str)
+        yield b"]"
+
+    return _chunks()
+
+async def get_document_by_id(collection: CollectionRef, document_id: str, projection: dict = None):
+    """Get a single document by its ObjectId string, or None if not found"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    if not ObjectId.is_valid(document_id):
+        return None
+
+    return await _collection(collection).find_one({"_id": ObjectId(document_id)}, projection)
+
+async def aggregate_documents(collection: CollectionRef, pipeline: list):
+    """Run an aggregation pipeline on a collection"""
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    return await _collection(collection).aggregate(pipeline).to_list(length=None)
+
+async def ensure_indexes():
+    """Create indexes for the hot query predicates (no-op without a database)"""
+    if db is None:
+        return
+
+    await timesheets.create_index([("project_id", 1), ("week_ending", 1)])
+    await submissions.create_index([("project_id", 1), ("week_ending", 1)])
+    await signatures.create_index("submission_id")
@@ -0,0 +1,19 @@
+"""
+Gunicorn Configuration
+
+Production launcher running one UvicornWorker per process so requests are
+spread across all cores:
+
+    gunicorn -c gunicorn_conf.py main:app
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * multiprocessing.cpu_count() + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the master so workers share it copy-on-write.
+# The Motor client connects lazily, so no sockets are inherited across fork.
+preload_app = True
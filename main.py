@@ -1,29 +1,69 @@
 import os
-from datetime import datetime
-from fastapi import FastAPI, HTTPException
+import asyncio
+import logging
+from cachetools import TTLCache
+from datetime import datetime, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, Tuple
 
-from database import db, create_document, get_documents
+from database import (
+    db, projects, employees, timesheets, submissions, signatures,
+    create_document, create_documents, get_document_by_id,
+    iter_documents, aggregate_documents, ensure_indexes,
+)
 from schemas import Project, WageRate, Employee, TimesheetEntry, Submission
 
-app = FastAPI(title="PrevailPay API")
+app = FastAPI(title="PrevailPay API", default_response_class=ORJSONResponse)
+
+# Comma-separated allow-list, e.g. "https://app.example.com,https://admin.example.com".
+# Unset or empty falls back to "*" rather than silently blocking all origins.
+# No cookies are used, so credentials stay off and "*" needs no per-origin echo.
+cors_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()] or ["*"]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=cors_origins,
+    allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+logger = logging.getLogger(__name__)
+
+_index_task = None
+
+async def _build_indexes():
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        logger.warning("Could not create MongoDB indexes: %s", e)
+
+@app.on_event("startup")
+async def create_indexes():
+    # Build indexes in the background so an unreachable database does not
+    # block or abort startup; /test still reports the connection error.
+    global _index_task
+    _index_task = asyncio.create_task(_build_indexes())
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"name": "PrevailPay", "message": "Certified payroll & compliance API running"}
 
+# /test is polled by health checks; only hit Mongo for the listing every 30s
+_collections_cache: TTLCache = TTLCache(maxsize=1, ttl=30)
+
+async def _list_collections_cached():
+    if "names" not in _collections_cache:
+        _collections_cache["names"] = (await db.list_collection_names())[:10]
+    return _collections_cache["names"]
+
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -32,130 +72,203 @@ def test_database():
         "connection_status": "Not Connected",
         "collections": []
     }
-    try:
-        if db is not None:
+    if db is None:
+        response["database"] = "⚠️ Available but not initialized"
+    else:
+        try:
             response["database"] = "✅ Connected & Working"
             response["database_url"] = "✅ Set"
             response["database_name"] = getattr(db, 'name', '✅ Connected')
             response["connection_status"] = "Connected"
-            response["collections"] = db.list_collection_names()[:10]
-        else:
-            response["database"] = "⚠️ Available but not initialized"
-    except Exception as e:
-        response["database"] = f"❌ Error: {str(e)[:80]}"
+            response["collections"] = await _list_collections_cached()
+        except Exception as e:
+            response["database"] = f"❌ Error: {str(e)[:80]}"
     response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
     response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
     return response
 
 # 1) Projects CRUD (basic endpoints)
+
+# Wage templates rarely change; cache them per project for a short TTL. The
+# TTL is the only staleness bound, across this and every other worker.
+_wage_template_cache: TTLCache = TTLCache(maxsize=256, ttl=60)
+
+async def _get_wage_templates_cached(project_id: str):
+    """Return a project's wage_templates, or None if the project does not exist"""
+    if project_id in _wage_template_cache:
+        return _wage_template_cache[project_id]
+    proj = await get_document_by_id(projects, project_id, projection={"wage_templates": 1})
+    if proj is None:
+        return None
+    rates = proj.get("wage_templates", [])
+    _wage_template_cache[project_id] = rates
+    return rates
+
 class ProjectCreate(Project):
     pass
 
 @app.post("/projects")
-def create_project(project: ProjectCreate):
-    project_id = create_document("project", project)
+async def create_project(project: ProjectCreate):
+    project_id = await create_document(projects, project)
     return {"id": project_id}
 
 @app.get("/projects")
-def list_projects():
-    return get_documents("project", {})
+async def list_projects():
+    return StreamingResponse(await iter_documents(projects, {}), media_type="application/json")
 
 # 2) Employees (lightweight directory)
 class EmployeeCreate(Employee):
     pass
 
 @app.post("/employees")
-def create_employee(emp: EmployeeCreate):
-    emp_id = create_document("employee", emp)
+async def create_employee(emp: EmployeeCreate):
+    emp_id = await create_document(employees, emp)
     return {"id": emp_id}
 
 @app.get("/employees")
-def list_employees():
-    return get_documents("employee", {})
+async def list_employees():
+    return StreamingResponse(await iter_documents(employees, {}), media_type="application/json")
 
 # 3) Timesheets: CSV-like entries and manual entry
 class TimesheetBulk(BaseModel):
     entries: List[TimesheetEntry]
 
-@app.post("/timesheets/bulk")
-def upload_timesheets(payload: TimesheetBulk):
-    ids = []
-    for entry in payload.entries:
-        ids.append(create_document("timesheetentry", entry))
+def _inline_json_schema(model: type) -> Dict[str, Any]:
+    """JSON schema for a model with its $defs inlined, for use in openapi_extra.
+
+    Pydantic's "#/$defs/..." refs would resolve against the OpenAPI document
+    root, which has no $defs.
+    """
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+
+    def resolve(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref", "")
+            if ref.startswith("#/$defs/"):
+                return resolve({**defs[ref.split("/")[-1]], **{k: v for k, v in node.items() if k != "$ref"}})
+            return {k: resolve(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [resolve(v) for v in node]
+        return node
+
+    return resolve(schema)
+
+@app.post(
+    "/timesheets/bulk",
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": _inline_json_schema(TimesheetBulk)}},
+    }},
+)
+async def upload_timesheets(request: Request):
+    # Parse and validate the raw body in one pydantic-core pass instead of
+    # going through FastAPI's json.loads + per-field body validation
+    try:
+        payload = TimesheetBulk.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Keep FastAPI's "body" prefix on error locations for 422 consumers
+        raise RequestValidationError(
+            [{**err, "loc": ("body",) + tuple(err["loc"])} for err in e.errors()]
+        )
+    ids = await create_documents(timesheets, payload.entries)
     return {"inserted": len(ids), "ids": ids}
 
+TIMESHEET_FIELDS = set(TimesheetEntry.model_fields) | {"_id", "created_at", "updated_at"}
+
 @app.get("/timesheets")
-def list_timesheets(project_id: str = None, week_ending: str = None):
+async def list_timesheets(project_id: str = None, week_ending: str = None, fields: str = None):
     filt: Dict[str, Any] = {}
     if project_id:
         filt["project_id"] = project_id
     if week_ending:
         filt["week_ending"] = week_ending
-    return get_documents("timesheetentry", filt)
+    # Optional comma-separated field list, e.g. ?fields=employee_name,hours
+    projection = None
+    if fields:
+        names = {f.strip() for f in fields.split(",") if f.strip()}
+        unknown = names - TIMESHEET_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        projection = {f: 1 for f in names} or None
+    return StreamingResponse(await iter_documents(timesheets, filt, projection=projection), media_type="application/json")
 
 # 4) Wage Engine & WH-347-like totals (simplified)
 
+CENTS = Decimal("0.01")
+HOURS_PLACES = Decimal("0.0001")  # strips float noise from Mongo's $sum, keeps 1/3 h entries
+
+def _dec(value) -> Decimal:
+    """Exact decimal for a stored number (via str, so 7.333 stays 7.333)"""
+    return Decimal(str(value))
+
 class GenerateRequest(BaseModel):
     project_id: str
     week_ending: str  # YYYY-MM-DD
 
 @app.post("/submissions/generate")
-def generate_submission(req: GenerateRequest):
-    # Load project & rates
-    projects = get_documents("project", {"_id": {"$exists": True}})
-    proj = next((p for p in projects if str(p.get("_id")) == req.project_id), None)
-    if not proj:
+async def generate_submission(req: GenerateRequest):
+    # Load project rates and sum timesheet hours for that week per
+    # (craft, apprentice) on the server, concurrently
+    rates, groups = await asyncio.gather(
+        _get_wage_templates_cached(req.project_id),
+        aggregate_documents(timesheets, [
+            {"$match": {"project_id": req.project_id, "week_ending": req.week_ending}},
+            {"$group": {
+                "_id": {"craft": "$craft", "apprentice": "$apprentice"},
+                "hours": {"$sum": "$hours"},
+            }},
+        ]),
+    )
+    if rates is None:
         raise HTTPException(status_code=404, detail="Project not found")
 
-    rates: List[Dict[str, Any]] = proj.get("wage_templates", [])
-
-    # Load timesheets for that week
-    rows = get_documents("timesheetentry", {"project_id": req.project_id, "week_ending": req.week_ending})
-
-    # Build rate lookup
-    rate_map: Dict[str, Dict[str, float]] = {}
+    # Build rate lookup as exact Decimals:
+    # craft -> (journeyman base, apprentice base, fringe)
+    rate_map: Dict[str, Tuple[Decimal, Decimal, Decimal]] = {}
     for r in rates:
-        craft = r.get("craft")
-        rate_map[craft] = {
-            "base": float(r.get("base_rate", 0)),
-            "fringe": float(r.get("fringe_rate", 0)),
-            "apprentice_factor": float(r.get("apprentice_factor", 0.6)),
-        }
-
-    totals: Dict[str, float] = {
-        "hours": 0.0,
-        "base_pay": 0.0,
-        "fringe": 0.0,
-        "gross": 0.0,
+        base = _dec(r.get("base_rate", 0))
+        rate_map[r.get("craft")] = (
+            base,
+            base * _dec(r.get("apprentice_factor", 0.6)),
+            _dec(r.get("fringe_rate", 0)),
+        )
+
+    # Accumulate exact Decimal hours and pay; round only the final totals
+    totals: Dict[str, Decimal] = {
+        "hours": Decimal(0),
+        "base_pay": Decimal(0),
+        "fringe": Decimal(0),
+        "gross": Decimal(0),
     }
-    warnings: List[str] = []
-
-    for t in rows:
-        craft = t.get("craft")
-        hours = float(t.get("hours", 0))
-        apprentice = bool(t.get("apprentice", False))
-        if craft not in rate_map:
-            warnings.append(f"Missing wage rate for craft '{craft}'")
-            continue
-        rm = rate_map[craft]
-        base_rate = rm["base"] * (rm["apprentice_factor"] if apprentice else 1.0)
-        fringe_rate = rm["fringe"]
-        base_pay = base_rate * hours
+
+    # One warning per unknown craft, then drop its groups before totalling
+    missing = {g["_id"]["craft"] for g in groups} - rate_map.keys()
+    warnings: List[str] = [f"Missing wage rate for craft '{c}'" for c in sorted(missing)]
+    groups = [g for g in groups if g["_id"]["craft"] in rate_map]
+
+    for g in groups:
+        # Entries were validated by TimesheetEntry at ingest, so types are trusted
+        craft, apprentice, hours = g["_id"]["craft"], g["_id"]["apprentice"], _dec(g["hours"])
+        base_full, base_app, fringe_rate = rate_map[craft]
+        base_pay = (base_app if apprentice else base_full) * hours
         fringe_pay = fringe_rate * hours
-        gross = base_pay + fringe_pay
         totals["hours"] += hours
         totals["base_pay"] += base_pay
         totals["fringe"] += fringe_pay
-        totals["gross"] += gross
+        totals["gross"] += base_pay + fringe_pay
 
     sub = Submission(
         project_id=req.project_id,
         week_ending=req.week_ending,
-        totals={k: round(v, 2) for k, v in totals.items()},
+        totals={
+            k: float(v.quantize(HOURS_PLACES if k == "hours" else CENTS, rounding=ROUND_HALF_UP))
+            for k, v in totals.items()
+        },
         warnings=warnings,
         status="generated",
     )
-    sub_id = create_document("submission", sub)
+    sub_id = await create_document(submissions, sub)
     return {"id": sub_id, **sub.model_dump()}
 
 class SignRequest(BaseModel):
@@ -164,28 +277,28 @@ class SignRequest(BaseModel):
     signer_title: str
 
 @app.post("/submissions/sign")
-def sign_submission(req: SignRequest):
+async def sign_submission(req: SignRequest):
     # Store a signature record as a new document for immutability
     sig = {
         "submission_id": req.submission_id,
         "signer_name": req.signer_name,
         "signer_title": req.signer_title,
-        "signed_at": datetime.utcnow().isoformat(),
+        "signed_at": datetime.now(timezone.utc),
         "type": "statement_of_compliance"
     }
-    sig_id = create_document("signature", sig)
+    sig_id = await create_document(signatures, sig)
     return {"signature_id": sig_id, "status": "signed"}
 
 @app.get("/submissions")
-def list_submissions(project_id: str = None, week_ending: str = None):
+async def list_submissions(project_id: str = None, week_ending: str = None):
     filt: Dict[str, Any] = {}
     if project_id:
         filt["project_id"] = project_id
     if week_ending:
         filt["week_ending"] = week_ending
-    return get_documents("submission", filt)
+    return StreamingResponse(await iter_documents(submissions, filt), media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="uvloop", http="httptools")